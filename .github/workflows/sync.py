@@ -2,129 +2,359 @@
 """
 Weekly sync script for SIGNAL TV Tracker.
 1. Checks TMDB for new seasons on shows in waiting_for_next_season
+   - One Claude call pre-filters shows likely to have aired (full scan on days 1-7 of each month)
    - Verifies air date is in the past before moving (avoids announced-but-unaired seasons)
 2. Moves newly available shows to available_to_watch_next
 3. Generates 3-5 Claude recommendations based on finished_watching ratings
 4. Dedups recommendations against series_to_explore
 """
 
+import asyncio
+import contextvars
+import io
 import json
+import logging
 import os
-import time
 import re
-import requests
+import sys
+import time
 from datetime import datetime, timezone, date
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 SHOWS_FILE = os.environ.get('SHOWS_FILE', 'shows.json')
+CACHE_FILE = os.environ.get('TMDB_CACHE_FILE', '.tmdb_cache.json')
 TMDB_TOKEN = os.environ.get('TMDB_TOKEN', '')
 ANTHROPIC_KEY = os.environ.get('ANTHROPIC_API_KEY', '')
+TMDB_CONCURRENCY = 20  # TMDB allows 20 simultaneous connections per IP
+TMDB_RETRY_STATUS = (429, 500, 502, 503, 504)
+TMDB_OWNED_FIELDS = ('tmdb_id', 'next_season', 'total_seasons', 'show_status')
+
+log = logging.getLogger('signal-sync')
+_capture = contextvars.ContextVar('capture', default=None)
+
+class _CaptureFilter(logging.Filter):
+    """Holds back records from a capturing per-show task so each show's lines print together."""
+
+    def filter(self, record):
+        records = _capture.get()
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+log.addFilter(_CaptureFilter())
+
+class _BufferedHandler(logging.StreamHandler):
+    """StreamHandler without the per-record flush -- output goes out once per phase."""
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+_FENCE_OPEN = re.compile(r'^```json\s*')
+_FENCE_CLOSE = re.compile(r'```$')
+
+# TMDB response cache: {path: {'etag': ..., 'body': ...}} -- revalidated with If-None-Match
+TMDB_CACHE = {}
 
 # ── LOAD / SAVE ────────────────────────────────────────────────────────────
 
-def load_db():
-    with open(SHOWS_FILE, 'r', encoding='utf-8') as f:
+def _read_json(path):
+    if orjson:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())
+    with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def _write_json(path, data, indent=True):
+    if orjson:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if indent else 0))
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2 if indent else None, ensure_ascii=False)
+
+def load_db():
+    if os.path.exists(CACHE_FILE):
+        TMDB_CACHE.update(_read_json(CACHE_FILE))
+    return _read_json(SHOWS_FILE)
+
 def save_db(db):
     db['last_updated'] = datetime.now(timezone.utc).isoformat()
-    with open(SHOWS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(db, f, indent=2, ensure_ascii=False)
-    print(f"Saved {SHOWS_FILE}")
+    _write_json(SHOWS_FILE, db)
+    log.info(f"Saved {SHOWS_FILE}")
+    # Keep only what the current Waiting list would request -- drops shows that left Waiting or
+    # moved on to a new next_season, but keeps ETags for shows the pre-filter skipped this week
+    wanted = {tmdb_show_path(s) for s in db.get('waiting_for_next_season', []) if s.get('tmdb_id')}
+    for path in TMDB_CACHE.keys() - wanted:
+        del TMDB_CACHE[path]
+    _write_json(CACHE_FILE, TMDB_CACHE, indent=False)
+    log.info(f"Saved {CACHE_FILE} ({len(TMDB_CACHE)} entries)")
 
 # ── TMDB ───────────────────────────────────────────────────────────────────
 
-def tmdb_get(path):
+class TokenBucket:
+    """
+    Token bucket for the event loop -- acquire() only waits when the bucket is empty.
+    No lock needed: refill and take happen between awaits on a single loop.
+    """
+
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.refill_rate)
+
+_CLIENT = None
+
+def get_client():
+    """
+    Shared HTTP/2 client -- every TMDB call multiplexes over its connection pool.
+    Built on first use so dry runs without a token never import httpx.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        import httpx
+        _CLIENT = httpx.AsyncClient(
+            headers={
+                'Authorization': f'Bearer {TMDB_TOKEN}',
+                'Accept': 'application/json'
+            },
+            # retries here cover connect failures; read errors and 429/5xx are retried in tmdb_get
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                limits=httpx.Limits(max_connections=TMDB_CONCURRENCY),
+                retries=3
+            ),
+            timeout=10
+        )
+    return _CLIENT
+
+async def close_client():
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+# Well under TMDB's ~50 req/s ceiling, shared by every in-flight check
+BUCKET = TokenBucket(capacity=20, refill_rate=20)
+
+def tmdb_show_path(show):
+    """Show details plus the next season's detail, in one TMDB request."""
+    return f"/tv/{show['tmdb_id']}?append_to_response=season/{show.get('seasons_watched', 1) + 1}"
+
+async def tmdb_get(path):
     if not TMDB_TOKEN:
-        print(f"  SKIP (no TMDB token): {path}")
+        log.info(f"  SKIP (no TMDB token): {path}")
         return None
     url = f"https://api.themoviedb.org/3{path}"
-    res = requests.get(url, headers={
-        'Authorization': f'Bearer {TMDB_TOKEN}',
-        'Accept': 'application/json'
-    }, timeout=10)
+    cached = TMDB_CACHE.get(path)
+    headers = {'If-None-Match': cached['etag']} if cached else {}
+    import httpx
+    for attempt in range(4):
+        await BUCKET.acquire()
+        try:
+            res = await get_client().get(url, headers=headers)
+        except httpx.TransportError as e:
+            # Read timeouts / dropped streams -- one flaky show must not abort the whole sync
+            if attempt == 3:
+                log.info(f"  TMDB request failed for {path}: {e!r}")
+                return None
+        else:
+            if res.status_code not in TMDB_RETRY_STATUS or attempt == 3:
+                break
+        await asyncio.sleep(0.5 * 2 ** attempt)
+    if res.status_code == 304 and cached:
+        return cached['body']
     if res.status_code == 200:
-        return res.json()
-    print(f"  TMDB error {res.status_code} for {path}")
+        body = res.json()
+        etag = res.headers.get('ETag')
+        if etag:
+            TMDB_CACHE[path] = {'etag': etag, 'body': body}
+        return body
+    log.info(f"  TMDB error {res.status_code} for {path}")
     return None
 
-def season_has_aired(tmdb_id, season_number):
+def season_has_aired(season_data, season_number, today):
     """
-    Fetch TMDB season detail and confirm air_date is today or in the past.
+    Confirm a TMDB season payload's air_date is today or in the past.
     TMDB lists announced but unaired seasons -- must verify the actual air date.
     """
-    data = tmdb_get(f"/tv/{tmdb_id}/season/{season_number}")
-    time.sleep(0.25)
-    if not data:
-        return False
-    air_date_str = data.get('air_date') or ''
+    air_date_str = season_data.get('air_date') or ''
     if not air_date_str:
-        print(f"      No air date for S{season_number} -- treating as not yet aired")
+        log.info(f"      No air date for S{season_number} -- treating as not yet aired")
         return False
     try:
-        aired = datetime.strptime(air_date_str, '%Y-%m-%d').date()
-        today = datetime.now(timezone.utc).date()
-        print(f"      S{season_number} air date: {air_date_str} | Today: {today}")
+        aired = date.fromisoformat(air_date_str)
+        log.info(f"      S{season_number} air date: {air_date_str} | Today: {today}")
         return aired <= today
     except Exception as e:
-        print(f"      Could not parse air date '{air_date_str}': {e}")
+        log.info(f"      Could not parse air date '{air_date_str}': {e}")
         return False
 
-def check_season_updates(db):
+async def _check_one(show, today):
+    """
+    Check a single waiting show against TMDB.
+    Returns (show, moved_entry) -- moved_entry is None if the show keeps waiting.
+    """
+    tmdb_id = show.get('tmdb_id')
+    if not tmdb_id:
+        log.info(f"  Skipping {show['title']} -- no TMDB ID")
+        return show, None
+
+    seasons_watched = show.get('seasons_watched', 1)
+    next_season = seasons_watched + 1
+
+    log.info(f"  Checking: {show['title']} (TMDB {tmdb_id})")
+    data = await tmdb_get(tmdb_show_path(show))
+
+    if not data:
+        return show, None
+
+    tmdb_total = data.get('number_of_seasons', show.get('total_seasons', 1))
+    tmdb_status = data.get('status', show.get('show_status', 'Continuing'))
+
+    show['total_seasons'] = tmdb_total
+    show['show_status'] = tmdb_status
+
+    season_data = data.get(f'season/{next_season}')
+    if tmdb_total < next_season or not season_data:
+        log.info(f"    -> No new season yet. Watched {seasons_watched}/{tmdb_total}")
+        return show, None
+
+    log.info(f"    -> TMDB shows S{next_season} exists. Verifying air date...")
+    if not season_has_aired(season_data, next_season, today):
+        log.info(f"    -> S{next_season} not yet aired. Keeping in Waiting.")
+        return show, None
+
+    log.info(f"    -> Confirmed aired. Moving to Available Next.")
+    return show, {
+        'id': show['id'],
+        'title': show['title'],
+        'tmdb_id': tmdb_id,
+        'next_season': next_season,
+        'total_seasons': tmdb_total,
+        'show_status': tmdb_status,
+        'network': show.get('network', ''),
+        'notes': show.get('notes', '')
+    }
+
+def llm_prefilter(waiting, today):
+    """
+    Ask Claude in one call which waiting shows have likely aired their next season.
+    Best-effort only -- flagged shows are still verified against TMDB.
+    Returns a set of tmdb_ids, or None if the pre-filter is unavailable (check everything).
+    """
+    candidates = [
+        {'title': s['title'], 'tmdb_id': s['tmdb_id'], 'next_season': s.get('seasons_watched', 1) + 1}
+        for s in waiting if s.get('tmdb_id')
+    ]
+    # Without a TMDB token nothing gets verified anyway -- don't pay for the Claude call
+    if not ANTHROPIC_KEY or not TMDB_TOKEN or not candidates:
+        return None
+
+    prompt = (
+        "Today is " + today.isoformat() + "."
+        "\nFor each TV series below, decide whether the listed next_season has likely "
+        "premiered (first episode aired on or before today)."
+        "\nWhen unsure, answer true -- a false positive only costs one extra lookup."
+        "\n\n" + json.dumps(candidates, ensure_ascii=False) +
+        "\n\nReturn ONLY valid JSON array, no markdown, no explanation:"
+        "\n[{\"tmdb_id\": 12345, \"likely_aired\": true}]"
+    )
+
+    import anthropic
+    client = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
+
+    log.info(f"  Asking Claude to pre-filter {len(candidates)} waiting shows...")
+    try:
+        message = client.messages.create(
+            model="claude-sonnet-4-20250514",
+            max_tokens=1024,
+            messages=[{"role": "user", "content": prompt}]
+        )
+        raw = message.content[0].text.strip()
+        raw = _FENCE_OPEN.sub('', raw)
+        raw = _FENCE_CLOSE.sub('', raw)
+        answers = {int(a['tmdb_id']): bool(a.get('likely_aired')) for a in json.loads(raw)}
+    except Exception as e:
+        log.info(f"  Claude pre-filter error: {e} -- checking all shows")
+        return None
+
+    # Anything Claude skipped over is kept as a candidate
+    likely = {c['tmdb_id'] for c in candidates if answers.get(c['tmdb_id'], True)}
+    log.info(f"  Claude flagged {len(likely)}/{len(candidates)} shows as likely aired")
+    return likely
+
+async def check_season_updates(db):
     waiting = db.get('waiting_for_next_season', [])
-    still_waiting = []
-    moved_to_available = []
-
-    for show in waiting:
-        tmdb_id = show.get('tmdb_id')
-        if not tmdb_id:
-            print(f"  Skipping {show['title']} -- no TMDB ID")
-            still_waiting.append(show)
-            continue
-
-        print(f"  Checking: {show['title']} (TMDB {tmdb_id})")
-        data = tmdb_get(f"/tv/{tmdb_id}")
-        time.sleep(0.25)
-
-        if not data:
-            still_waiting.append(show)
-            continue
-
-        tmdb_total = data.get('number_of_seasons', show.get('total_seasons', 1))
-        tmdb_status = data.get('status', show.get('show_status', 'Continuing'))
-        seasons_watched = show.get('seasons_watched', 1)
-        next_season = seasons_watched + 1
-
-        show['total_seasons'] = tmdb_total
-        show['show_status'] = tmdb_status
-
-        if tmdb_total >= next_season:
-            print(f"    -> TMDB shows S{next_season} exists. Verifying air date...")
-            if season_has_aired(tmdb_id, next_season):
-                print(f"    -> Confirmed aired. Moving to Available Next.")
-                moved_to_available.append({
-                    'id': show['id'],
-                    'title': show['title'],
-                    'tmdb_id': tmdb_id,
-                    'next_season': next_season,
-                    'total_seasons': tmdb_total,
-                    'show_status': tmdb_status,
-                    'network': show.get('network', ''),
-                    'notes': show.get('notes', '')
-                })
-            else:
-                print(f"    -> S{next_season} not yet aired. Keeping in Waiting.")
-                still_waiting.append(show)
-        else:
-            print(f"    -> No new season yet. Watched {seasons_watched}/{tmdb_total}")
-            still_waiting.append(show)
+
+    # Runs on days 1-7 of each month are a full TMDB scan -- safety net for pre-filter misses
+    today = datetime.now(timezone.utc).date()
+    likely = None
+    if today.day > 7:
+        # Blocking SDK call -- run it off the event loop
+        likely = await asyncio.to_thread(llm_prefilter, waiting, today)
+    else:
+        log.info("  Monthly full scan (days 1-7) -- skipping Claude pre-filter")
+
+    sem = asyncio.Semaphore(TMDB_CONCURRENCY)
+
+    async def check(show):
+        # Each gathered task runs in its own context copy, so this capture is per show
+        records = []
+        _capture.set(records)
+        if likely is not None and show.get('tmdb_id') and show['tmdb_id'] not in likely:
+            log.info(f"  Skipped by pre-filter: {show['title']} (TMDB {show['tmdb_id']})")
+            return (show, None), records
+        async with sem:
+            return await _check_one(show, today), records
+
+    # Checks overlap on one event loop; gather keeps results (and their log lines) in waiting-list order
+    try:
+        checked = await asyncio.gather(*(check(show) for show in waiting))
+    finally:
+        await close_client()
+
+    results = []
+    for result, records in checked:
+        for record in records:
+            log.handle(record)
+        results.append(result)
+
+    still_waiting = [show for show, moved in results if moved is None]
+    moved_to_available = [moved for _, moved in results if moved is not None]
 
     db['waiting_for_next_season'] = still_waiting
 
-    existing_ids = {s['id'] for s in db.get('available_to_watch_next', [])}
+    # Merge by id -- a show already in Available Next only gets its TMDB-owned fields refreshed
+    # (user-edited notes/network stay); new shows are appended
+    available = {s['id']: s for s in db.get('available_to_watch_next', [])}
     for show in moved_to_available:
-        if show['id'] not in existing_ids:
-            db['available_to_watch_next'].append(show)
-            print(f"  Moved to Available Next: {show['title']}")
+        existing = available.get(show['id'])
+        if existing is None:
+            available[show['id']] = show
+            log.info(f"  Moved to Available Next: {show['title']}")
+        else:
+            existing.update({k: show[k] for k in TMDB_OWNED_FIELDS})
+    db['available_to_watch_next'] = list(available.values())
 
     return len(moved_to_available)
 
@@ -161,32 +391,32 @@ HARD AVOIDS:
 - Lore-heavy franchises / expanding universes
 """
 
+TRACKED_LISTS = ('watching_now', 'available_to_watch_next', 'waiting_for_next_season',
+                 'series_to_explore', 'claude_recommendations', 'finished_watching',
+                 'dismissed_recommendations')
+
 def generate_recommendations(db):
     if not ANTHROPIC_KEY:
-        print("  SKIP (no Anthropic key)")
+        log.info("  SKIP (no Anthropic key)")
         return
 
     existing_recos = db.get('claude_recommendations', [])
     slots_needed = 5 - len(existing_recos)
 
     if slots_needed <= 0:
-        print("  Already have 5 recommendations — skipping.")
+        log.info("  Already have 5 recommendations — skipping.")
         return
 
-    print(f"  Have {len(existing_recos)} existing recos. Need {slots_needed} more.")
+    log.info(f"  Have {len(existing_recos)} existing recos. Need {slots_needed} more.")
 
     finished = db.get('finished_watching', [])
     excellent = [s['title'] for s in finished if s.get('rating') == 'Excellent']
     good = [s['title'] for s in finished if s.get('rating') == 'Good']
     abandoned = [s['title'] for s in finished if s.get('rating') == 'Abandoned Halfway']
 
-    # Build full exclusion set — everything already tracked
-    all_titles = set()
-    for list_name in ['watching_now', 'available_to_watch_next', 'waiting_for_next_season',
-                      'series_to_explore', 'claude_recommendations', 'finished_watching',
-                      'dismissed_recommendations']:
-        for show in db.get(list_name, []):
-            all_titles.add(show.get('title', '').lower())
+    # Build full exclusion set — everything already tracked (reused by the dedup below)
+    all_titles = {show.get('title', '').lower()
+                  for list_name in TRACKED_LISTS for show in db.get(list_name, ())}
 
     # Build dismissed context grouped by reason
     dismissed = db.get('dismissed_recommendations', [])
@@ -210,9 +440,9 @@ def generate_recommendations(db):
 
     dismissed_context = ('\n' + '\n'.join(dismissed_lines)) if dismissed_lines else ''
 
+    # Static taste profile goes in the cached system block; only CURRENT DATA varies per run
     prompt = (
-        TASTE_PROFILE +
-        "\n\nCURRENT DATA:"
+        "CURRENT DATA:"
         "\nExcellent: " + (', '.join(excellent) or 'none') +
         "\nGood: " + (', '.join(good) or 'none') +
         "\nAbandoned: " + (', '.join(abandoned) or 'none') +
@@ -242,64 +472,76 @@ def generate_recommendations(db):
     import anthropic
     client = anthropic.Anthropic(api_key=ANTHROPIC_KEY)
 
-    print("  Calling Claude for recommendations...")
+    log.info("  Calling Claude for recommendations...")
     try:
-        message = client.messages.create(
+        # Stream the completion -- text is collected as it arrives rather than in one final body
+        with client.messages.stream(
             model="claude-sonnet-4-20250514",
             max_tokens=1024,
+            system=[{"type": "text", "text": TASTE_PROFILE, "cache_control": {"type": "ephemeral"}}],
             messages=[{"role": "user", "content": prompt}]
-        )
-        raw = message.content[0].text.strip()
-        raw = re.sub(r'^```json\s*', '', raw)
-        raw = re.sub(r'```$', '', raw)
+        ) as stream:
+            raw = ''.join(stream.text_stream).strip()
+        raw = _FENCE_OPEN.sub('', raw)
+        raw = _FENCE_CLOSE.sub('', raw)
         recommendations = json.loads(raw)
     except Exception as e:
-        print(f"  Claude error: {e}")
+        log.info(f"  Claude error: {e}")
         return
 
-    seen = set(all_titles)
-    new_recos = []
-
-    for r in recommendations:
-        title = r.get('title', '').strip()
-        if not title or title.lower() in seen:
-            print(f"  Dedup skip: {title}")
-            continue
-        show_id = re.sub(r'[^a-z0-9]+', '-', title.lower()).strip('-')
-        new_recos.append({
-            'id': show_id,
-            'title': title,
-            'tmdb_id': r.get('tmdb_id'),
-            'total_seasons': r.get('total_seasons'),
-            'show_status': r.get('show_status', 'Ended'),
-            'network': r.get('network', ''),
-            'reason': r.get('reason', '')
-        })
-        seen.add(title.lower())
-        if len(new_recos) >= slots_needed:
-            break
+    # Dedup against tracked titles (and within the batch), then cap before slugifying.
+    # Claude is asked for slots_needed items; anything past 10 is over-generation.
+    seen = all_titles
+    titles = [(r, r.get('title', '').strip()) for r in recommendations[:10]]
+    fresh = [(r, t) for r, t in titles
+             if t and t.lower() not in seen and not seen.add(t.lower())]
+    kept = {id(r) for r, _ in fresh}
+    skipped = [t for r, t in titles if id(r) not in kept]
+    if skipped:
+        log.info(f"  Dedup skip: {', '.join(t or '(untitled)' for t in skipped)}")
+
+    new_recos = [{
+        'id': _SLUG_RE.sub('-', t.lower()).strip('-'),
+        'title': t,
+        'tmdb_id': r.get('tmdb_id'),
+        'total_seasons': r.get('total_seasons'),
+        'show_status': r.get('show_status', 'Ended'),
+        'network': r.get('network', ''),
+        'reason': r.get('reason', '')
+    } for r, t in fresh[:slots_needed]]
 
     # Append new recos to existing ones (preserve undismissed)
     db['claude_recommendations'] = existing_recos + new_recos
-    print(f"  Added {len(new_recos)} new recommendations (total: {len(db['claude_recommendations'])})")
+    log.info(f"  Added {len(new_recos)} new recommendations (total: {len(db['claude_recommendations'])})")
     for r in new_recos:
-        print(f"    . {r['title']} ({r.get('network','')}): {r['reason'][:80]}...")
+        log.info(f"    . {r['title']} ({r.get('network','')}): {r['reason'][:80]}...")
 
 # ── MAIN ───────────────────────────────────────────────────────────────────
 
 def main():
-    print(f"=== SIGNAL Weekly Sync ({datetime.now().isoformat()}) ===")
+    # Block-buffered stdout, flushed after each phase (and by logging.shutdown() at exit)
+    out = _BufferedHandler(io.TextIOWrapper(sys.stdout.buffer, encoding=sys.stdout.encoding,
+                                            write_through=False))
+    out.setFormatter(logging.Formatter('%(message)s'))
+    # Only our logger goes to INFO -- httpx/anthropic log every request at INFO via the root logger
+    log.setLevel(logging.INFO)
+    log.addHandler(out)
+    log.propagate = False
+
+    log.info(f"=== SIGNAL Weekly Sync ({datetime.now().isoformat()}) ===")
     db = load_db()
 
-    print("\n[1] Checking season updates for Waiting shows...")
-    moved = check_season_updates(db)
-    print(f"  -> {moved} shows moved to Available Next")
+    log.info("\n[1] Checking season updates for Waiting shows...")
+    moved = asyncio.run(check_season_updates(db))
+    log.info(f"  -> {moved} shows moved to Available Next")
+    out.flush()
 
-    print("\n[2] Generating Claude recommendations...")
+    log.info("\n[2] Generating Claude recommendations...")
     generate_recommendations(db)
+    out.flush()
 
     save_db(db)
-    print("\n=== Done ===")
+    log.info("\n=== Done ===")
 
 if __name__ == '__main__':
     main()